@@ -1,22 +1,174 @@
 from sentence_transformers import SentenceTransformer
 from functools import lru_cache
+from cachetools import LRUCache
+from typing import Optional
+import asyncio
 import os
+import numpy as np
+import torch
 
 MODEL_NAME = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# "onnx" runs the quantized export through onnxruntime, "torch" the original weights
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+# ONNX exports shipped with the model repo: INT8 (AVX-512 VNNI) for CPU, O4 (fp16) for GPU
+ONNX_CPU_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+ONNX_GPU_FILE = os.getenv("EMBEDDING_ONNX_GPU_FILE", "onnx/model_O4.onnx")
+# Half precision for the torch backend; only applied on CUDA devices
+EMBEDDING_FP16 = os.getenv("EMBEDDING_FP16", "0") == "1"
+
+# Inference only: no autograd tape, use every core for intra-op parallelism
+torch.set_grad_enabled(False)
+torch.set_num_threads(os.cpu_count() or 1)
+
+# Dynamic batching: concurrent encode requests are coalesced into one forward pass
+MAX_BATCH = 32
+MAX_WAIT = 0.005  # seconds to wait for more requests after the first one arrives
+
+# Embeddings of recent search queries; they don't change when ideas are stored
+_query_cache: LRUCache = LRUCache(maxsize=1024)
+
+_queue: Optional[asyncio.Queue] = None
+_worker_task: Optional[asyncio.Task] = None
+
+
+def _onnx_model_kwargs() -> dict:
+    import onnxruntime as ort
+
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = os.cpu_count() or 1
+
+    if "CUDAExecutionProvider" in ort.get_available_providers():
+        return {
+            "file_name": ONNX_GPU_FILE,
+            "provider": "CUDAExecutionProvider",
+            "session_options": sess_options
+        }
+    return {
+        "file_name": ONNX_CPU_FILE,
+        "provider": "CPUExecutionProvider",
+        "session_options": sess_options
+    }
 
 
 @lru_cache(maxsize=1)
 def get_model():
-    return SentenceTransformer(MODEL_NAME)
+    if EMBEDDING_BACKEND == "onnx":
+        return SentenceTransformer(
+            MODEL_NAME,
+            backend="onnx",
+            model_kwargs=_onnx_model_kwargs()
+        )
 
+    model = SentenceTransformer(MODEL_NAME)
+    model.eval()
+    if EMBEDDING_FP16 and torch.cuda.is_available():
+        model.half()
+    return model
 
-def create_embedding(text: str) -> list[float]:
-    model = get_model()
-    embedding = model.encode(text, normalize_embeddings=True)
-    return embedding.tolist()
+
+def warm_up_model():
+    """Load the model and run a dummy batch so the first request pays no setup cost."""
+    get_model().encode(["warmup"] * 8, batch_size=8)
+
+
+def _encode_sorted(texts: list[str], batch_size: int) -> np.ndarray:
+    """Encode texts sorted by length to minimize padding, returned in input order."""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    embeddings = get_model().encode(
+        [texts[i] for i in order],
+        batch_size=batch_size,
+        normalize_embeddings=True,
+        convert_to_numpy=True
+    )
+    result = np.empty_like(embeddings)
+    result[order] = embeddings
+    return result
 
 
 def create_embeddings_batch(texts: list[str]) -> list[list[float]]:
-    model = get_model()
-    embeddings = model.encode(texts, normalize_embeddings=True)
-    return embeddings.tolist()
+    return _encode_sorted(texts, batch_size=64).tolist()
+
+
+async def encode_async(text: str) -> list[float]:
+    """Queue a text for the batch worker and wait for its embedding."""
+    if _queue is None:
+        raise RuntimeError("Embedding batch worker not started")
+
+    future = asyncio.get_running_loop().create_future()
+    await _queue.put((text, future))
+    return await future
+
+
+async def encode_query(text: str) -> list[float]:
+    """encode_async with an LRU cache for repeated search queries."""
+    embedding = _query_cache.get(text)
+    if embedding is None:
+        embedding = await encode_async(text)
+        _query_cache[text] = embedding
+    return embedding
+
+
+async def _collect_batch() -> list[tuple[str, asyncio.Future]]:
+    """Wait for one request, then gather more for up to MAX_WAIT seconds."""
+    loop = asyncio.get_running_loop()
+    batch = [await _queue.get()]
+    deadline = loop.time() + MAX_WAIT
+
+    while len(batch) < MAX_BATCH:
+        try:
+            batch.append(_queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(_queue.get(), timeout=remaining))
+        except asyncio.TimeoutError:
+            break
+
+    return batch
+
+
+async def _batch_worker():
+    """Encode queued texts in batches and resolve the waiting futures."""
+    while True:
+        batch = await _collect_batch()
+        # Skip callers that went away while waiting
+        batch = [(text, future) for text, future in batch if not future.done()]
+        if not batch:
+            continue
+
+        texts = [text for text, _ in batch]
+
+        try:
+            embeddings = await asyncio.to_thread(_encode_sorted, texts, MAX_BATCH)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding.tolist())
+
+
+def start_batch_worker():
+    global _queue, _worker_task
+    if _worker_task is None or _worker_task.done():
+        _queue = asyncio.Queue()
+        _worker_task = asyncio.create_task(_batch_worker())
+
+
+async def stop_batch_worker():
+    global _worker_task
+    if _worker_task:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
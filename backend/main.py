@@ -1,46 +1,235 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse, Response
+from fastapi.responses import HTMLResponse, FileResponse, Response, ORJSONResponse, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 from contextlib import asynccontextmanager
 import asyncio
-import json
+import time
+import orjson
+from cachetools import TTLCache
 import numpy as np
-from sklearn.cluster import KMeans
+import faiss
 from datetime import datetime
+from typing import Optional
+from html import escape
+from jinja2 import Environment, select_autoescape
 
 from models import NostrEvent
 from qdrant_service import (
-    init_collection, store_idea, search_similar,
-    find_related, get_all_vectors_with_payload, get_idea_by_event_id,
-    find_referencing_ideas
+    init_collection, close_client, store_idea, store_ideas, search_similar,
+    find_related, iter_point_pages,
+    get_ideas_by_event_ids, get_recent_ideas, find_referencing_ideas,
+    CARD_FIELDS, LINK_FIELDS, VECTOR_SIZE
+)
+from embedding_service import (
+    encode_query, start_batch_worker, stop_batch_worker, warm_up_model
 )
 from nostr_client import NostrClient
 
-event_queues: list[asyncio.Queue] = []
+# Compiled once at import; autoescaping keeps user content out of the markup
+templates = Environment(autoescape=select_autoescape(default_for_string=True))
+
+# Cards are rendered once per list item, so they use a plain format string;
+# every interpolated value goes through escape()
+IDEA_CARD_FMT = (
+    '<article class="idea-card" hx-get="/components/idea-card/{0}" hx-trigger="click"'
+    ' hx-target="#idea-detail" hx-swap="innerHTML"><p class="content">{1}</p>'
+    '<div class="meta">{2}<span class="pubkey">{3}...</span></div></article>'
+)
+SCORE_FMT = '<span class="score">{0}% Relevanz</span>'
+
+IDEA_DETAIL_TMPL = templates.from_string("""
+    {%- macro idea_links(title, ideas, css_class="references") %}
+        <div class="{{ css_class }}">
+            <h4>{{ title }}</h4>
+            <ul>
+            {%- for r in ideas -%}
+                <li><a href="#" hx-get="/components/idea-card/{{ r.event_id }}" hx-target="#idea-detail">{{ (r.content_preview or "")[:50] }}...</a></li>
+            {%- endfor -%}
+            </ul>
+        </div>
+    {%- endmacro %}
+    <article class="idea-detail">
+        <p class="content">{{ content }}</p>
+        <div class="meta">
+            <time>{{ created }}</time>
+            <span class="pubkey">{{ pubkey[:16] }}...</span>
+        </div>
+        {%- if referenced %}{{ idea_links("Verweist auf", referenced) }}{% endif %}
+        {%- if referencing %}{{ idea_links("Verwiesen von", referencing) }}{% endif %}
+        {%- if related %}{{ idea_links("Ähnliche Ideen", related, "related") }}{% endif %}
+    </article>
+    """)
+
+event_queues: set[asyncio.Queue] = set()
+SSE_QUEUE_SIZE = 100
+SSE_PING_INTERVAL = 30  # seconds
 nostr_client: NostrClient = None
 
+# Relay events are stored in batches: one embedding pass and one upsert each
+INGEST_BATCH = 64
+INGEST_WAIT = 0.25  # seconds to keep collecting events after the first one arrives
+INGEST_QUEUE_SIZE = 1024
+_ingest_queue: Optional[asyncio.Queue] = None
+_ingest_task: Optional[asyncio.Task] = None
+
+# Bumped whenever an idea is stored; derived views are cached per version
+_collection_version: int = 0
+# Distinguishes ETags across restarts, since the version starts at 0 again
+_cache_epoch = int(time.time())
+_response_cache: dict[str, tuple[int, dict]] = {}
+
+# Search results per (version, normalized query, filters); the TTL bounds how
+# stale relative time ranges like "24h" can get between stores
+SEARCH_CACHE_MIN_QUERY = 3
+_search_cache: TTLCache = TTLCache(maxsize=2048, ttl=60)
+
+
+class IdeaLoader:
+    """Request-scoped idea lookups: each event ID is fetched from Qdrant at most once."""
+
+    def __init__(self):
+        self._ideas: dict[str, Optional[dict]] = {}
+
+    async def get_many(self, event_ids: list[str]) -> list[dict]:
+        """Return the known ideas for event_ids in input order, batching cache misses."""
+        missing = [event_id for event_id in dict.fromkeys(event_ids) if event_id not in self._ideas]
+        if missing:
+            found = await get_ideas_by_event_ids(missing)
+            # Remember misses too, so unknown references aren't looked up again
+            self._ideas.update(dict.fromkeys(missing))
+            self.prime(found)
+        return [self._ideas[event_id] for event_id in event_ids if self._ideas.get(event_id)]
+
+    async def get(self, event_id: str) -> Optional[dict]:
+        ideas = await self.get_many([event_id])
+        return ideas[0] if ideas else None
+
+    def prime(self, ideas: list[dict]):
+        for idea in ideas:
+            self._ideas[idea["event_id"]] = idea
 
-async def handle_new_idea(event: dict):
-    references = [tag[1] for tag in event.get("tags", []) if tag[0] == "e"]
 
-    store_idea(
-        event_id=event["id"],
-        content=event["content"],
-        pubkey=event["pubkey"],
-        created_at=event["created_at"],
-        references=references
+def broadcast_idea(event: dict):
+    """Serialize an event once and hand it to every SSE subscriber."""
+    payload = orjson.dumps(event).decode()
+    for queue in event_queues:
+        if queue.full():
+            # Slow client: drop its oldest pending event instead of blocking
+            queue.get_nowait()
+        queue.put_nowait(payload)
+
+
+def bump_collection_version():
+    global _collection_version
+    _collection_version += 1
+
+
+async def cached_json_response(request: Request, key: str, compute) -> Response:
+    """Serve the result of the async compute() per collection version, with ETag revalidation."""
+    version = _collection_version
+    etag = f'W/"{_cache_epoch}-{version}"'
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    cached = _response_cache.get(key)
+    if cached and cached[0] == version:
+        data = cached[1]
+    else:
+        data = await compute()
+        _response_cache[key] = (version, data)
+
+    return ORJSONResponse(data, headers={"ETag": etag})
+
+
+async def _run_search(q: str, limit: int, pubkey: str = None, time_range: str = None,
+                      fields: list[str] = None) -> list[dict]:
+    query_vector = await encode_query(q)
+    return await search_similar(
+        query_vector, limit=limit, pubkey_filter=pubkey, time_range=time_range, fields=fields
     )
 
-    for queue in event_queues:
-        await queue.put(event)
+
+async def cached_search(q: str, limit: int, pubkey: str = None, time_range: str = None,
+                        fields: list[str] = None) -> list[dict]:
+    """Search with results shared between identical queries, including in-flight ones."""
+    normalized = q.strip().lower()
+    if len(normalized) < SEARCH_CACHE_MIN_QUERY:
+        return await _run_search(normalized, limit, pubkey, time_range, fields)
+
+    key = (_collection_version, normalized, limit, pubkey, time_range, tuple(fields or ()))
+    task = _search_cache.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_run_search(normalized, limit, pubkey, time_range, fields))
+        _search_cache[key] = task
+
+    try:
+        # Shielded so one disconnecting client doesn't cancel the shared search
+        return await asyncio.shield(task)
+    except Exception:
+        _search_cache.pop(key, None)
+        raise
+
+
+async def handle_new_idea(event: dict):
+    # Blocks the relay receiver once the ingest worker falls behind
+    await _ingest_queue.put(event)
+
+
+async def _collect_ingest_batch() -> list[dict]:
+    """Wait for one relay event, then gather more for up to INGEST_WAIT seconds."""
+    loop = asyncio.get_running_loop()
+    batch = [await _ingest_queue.get()]
+    deadline = loop.time() + INGEST_WAIT
+
+    while len(batch) < INGEST_BATCH:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(_ingest_queue.get(), timeout=remaining))
+        except asyncio.TimeoutError:
+            break
+
+    return batch
+
+
+async def _ingest_worker():
+    """Store queued relay events in batches and broadcast them."""
+    while True:
+        events = await _collect_ingest_batch()
+
+        try:
+            await store_ideas([
+                {
+                    "event_id": event["id"],
+                    "content": event["content"],
+                    "pubkey": event["pubkey"],
+                    "created_at": event["created_at"],
+                    "references": [tag[1] for tag in event.get("tags", []) if tag[0] == "e"]
+                }
+                for event in events
+            ])
+        except Exception as e:
+            print(f"Storing {len(events)} relay ideas failed: {e}")
+            continue
+        bump_collection_version()
+
+        loop = asyncio.get_running_loop()
+        for event in events:
+            loop.call_soon(broadcast_idea, event)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global nostr_client
+    global nostr_client, _ingest_queue, _ingest_task
 
-    init_collection()
+    await init_collection()
+    await asyncio.to_thread(warm_up_model)
+    start_batch_worker()
+    _ingest_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    _ingest_task = asyncio.create_task(_ingest_worker())
     nostr_client = NostrClient()
 
     async def start_nostr():
@@ -61,9 +250,16 @@ async def lifespan(app: FastAPI):
 
     if nostr_client:
         await nostr_client.close()
+    _ingest_task.cancel()
+    try:
+        await _ingest_task
+    except asyncio.CancelledError:
+        pass
+    await stop_batch_worker()
+    await close_client()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
 
@@ -74,12 +270,12 @@ async def index():
 
 
 @app.get("/components/idea-card/{event_id}", response_class=HTMLResponse)
-async def idea_card(event_id: str):
-    idea = get_idea_by_event_id(event_id)
+async def idea_card(event_id: str, loader: IdeaLoader = Depends(IdeaLoader)):
+    idea = await loader.get(event_id)
     if not idea:
         raise HTTPException(404, "Idea not found")
 
-    return render_idea_card_from_payload(idea)
+    return await render_idea_card_from_payload(idea, loader)
 
 
 @app.post("/api/ideas")
@@ -95,54 +291,78 @@ async def create_idea(event: NostrEvent):
             print(f"Nostr publish failed (storing locally): {e}")
 
     # Always store in Qdrant as local cache
-    store_idea(
+    await store_idea(
         event_id=event.id,
         content=event.content,
         pubkey=event.pubkey,
         created_at=event.created_at,
         references=references
     )
+    bump_collection_version()
 
-    # Broadcast to SSE clients
-    for queue in event_queues:
-        await queue.put(event_dict)
+    # Broadcast to SSE clients after this handler returns, off the request path
+    asyncio.get_running_loop().call_soon(broadcast_idea, event_dict)
 
     return {"status": "ok", "event_id": event.id}
 
 
 @app.get("/api/search")
 async def search_ideas(q: str, limit: int = 10, pubkey: str = None, time: str = None):
-    results = search_similar(q, limit=limit, pubkey_filter=pubkey, time_range=time)
+    results = await cached_search(q, limit=limit, pubkey=pubkey, time_range=time)
     return {"results": results}
 
 
 @app.get("/api/related/{event_id}")
 async def get_related(event_id: str, limit: int = 5):
-    results = find_related(event_id, limit=limit)
+    results = await find_related(event_id, limit=limit)
     return {"results": results}
 
 
 @app.get("/api/clusters")
-async def get_clusters():
-    points = get_all_vectors_with_payload(limit=1000)
-
-    if len(points) < 5:
+async def get_clusters(request: Request):
+    return await cached_json_response(request, "clusters", compute_clusters)
+
+
+async def compute_clusters() -> dict:
+    limit = 1000
+    # One preallocated C-contiguous float32 matrix, the layout faiss expects,
+    # filled page by page so the point objects can be dropped right away
+    vectors = np.empty((limit, VECTOR_SIZE), dtype=np.float32)
+    event_ids, previews = [], []
+    async for points in iter_point_pages(limit=limit, fields=["content_preview"]):
+        for point in points:
+            vectors[len(event_ids)] = point.vector
+            event_ids.append(point.id)
+            previews.append(point.payload.get("content_preview", ""))
+
+    if len(event_ids) < 5:
         return {"clusters": []}
 
-    vectors = np.array([p.vector for p in points])
-    n_clusters = min(5, len(points) // 3)
+    # k-means is CPU-bound; keep it off the event loop
+    return await asyncio.to_thread(cluster_vectors, vectors[:len(event_ids)], event_ids, previews)
+
+
+def cluster_vectors(vectors: np.ndarray, event_ids: list, previews: list[str]) -> dict:
+    n_clusters = min(5, len(event_ids) // 3)
 
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(vectors)
+    kmeans = faiss.Kmeans(
+        d=vectors.shape[1], k=n_clusters,
+        niter=20, nredo=3, seed=42, verbose=False,
+        # Few ideas per centroid is the normal case here, not a misuse worth a warning
+        min_points_per_centroid=1
+    )
+    kmeans.train(vectors)
+    _, labels = kmeans.index.search(vectors, 1)
+    labels = labels.ravel()
 
     clusters = {}
-    for i, point in enumerate(points):
+    for i, event_id in enumerate(event_ids):
         cluster_id = int(labels[i])
         if cluster_id not in clusters:
             clusters[cluster_id] = []
         clusters[cluster_id].append({
-            "event_id": point.id,
-            "content_preview": point.payload.get("content_preview", "")
+            "event_id": event_id,
+            "content_preview": previews[i]
         })
 
     return {"clusters": list(clusters.values())}
@@ -150,69 +370,67 @@ async def get_clusters():
 
 @app.get("/api/export")
 async def export_ideas(format: str = "json", pubkey: str = None, time: str = None):
-    points = get_all_vectors_with_payload(limit=1000, time_range=time)
-
-    if pubkey:
-        points = [p for p in points if p.payload.get("pubkey") == pubkey]
-
-    sorted_points = sorted(
-        points,
-        key=lambda p: p.payload.get("created_at", 0),
-        reverse=True
+    recent = await get_recent_ideas(limit=1000, time_range=time, pubkey=pubkey)
+
+    ideas = (
+        {
+            "event_id": idea["event_id"],
+            "content": idea.get("content_preview", ""),
+            "pubkey": idea.get("pubkey", ""),
+            "created_at": idea.get("created_at", 0),
+            "references": idea.get("references", [])
+        }
+        for idea in recent
     )
 
-    ideas = []
-    for point in sorted_points:
-        ideas.append({
-            "event_id": point.payload.get("nostr_event_id", str(point.id)),
-            "content": point.payload.get("content_preview", ""),
-            "pubkey": point.payload.get("pubkey", ""),
-            "created_at": point.payload.get("created_at", 0),
-            "references": point.payload.get("references", [])
-        })
-
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     if format == "markdown":
-        lines = ["# IdeaFlow Export", f"\nExportiert: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"]
-        for idea in ideas:
-            created = datetime.fromtimestamp(idea["created_at"]).strftime("%d.%m.%Y %H:%M")
-            lines.append(f"## {created}")
-            lines.append(f"\n{idea['content']}\n")
-            lines.append(f"*Pubkey: {idea['pubkey'][:16]}...*\n")
-            if idea["references"]:
-                lines.append(f"*Referenzen: {', '.join(idea['references'][:3])}*\n")
-            lines.append("---\n")
-
-        content = "\n".join(lines)
-        return Response(
-            content=content,
+        return StreamingResponse(
+            _export_markdown(ideas),
             media_type="text/markdown",
             headers={"Content-Disposition": f"attachment; filename=ideaflow_export_{timestamp}.md"}
         )
     else:
-        content = json.dumps({"ideas": ideas, "exported_at": timestamp}, indent=2, ensure_ascii=False)
-        return Response(
-            content=content,
+        return StreamingResponse(
+            _export_json(ideas, timestamp),
             media_type="application/json",
             headers={"Content-Disposition": f"attachment; filename=ideaflow_export_{timestamp}.json"}
         )
 
 
+def _export_markdown(ideas):
+    yield f"# IdeaFlow Export\n\nExportiert: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n".encode()
+    for idea in ideas:
+        created = datetime.fromtimestamp(idea["created_at"]).strftime("%d.%m.%Y %H:%M")
+        lines = [
+            f"## {created}",
+            f"\n{idea['content']}\n",
+            f"*Pubkey: {idea['pubkey'][:16]}...*\n"
+        ]
+        if idea["references"]:
+            lines.append(f"*Referenzen: {', '.join(idea['references'][:3])}*\n")
+        lines.append("---\n")
+        yield "".join(f"\n{line}" for line in lines).encode()
+
+
+def _export_json(ideas, timestamp: str):
+    yield b'{"ideas":['
+    for i, idea in enumerate(ideas):
+        yield (b"," if i else b"") + orjson.dumps(idea)
+    yield b'],"exported_at":' + orjson.dumps(timestamp) + b"}"
+
+
 @app.get("/api/ideas/{event_id}/references")
-async def get_idea_references(event_id: str):
-    idea = get_idea_by_event_id(event_id)
+async def get_idea_references(event_id: str, loader: IdeaLoader = Depends(IdeaLoader)):
+    idea = await loader.get(event_id)
     if not idea:
         raise HTTPException(404, "Idea not found")
 
-    referenced_ids = idea.get("references", [])
-    referenced = []
-    for ref_id in referenced_ids:
-        ref_idea = get_idea_by_event_id(ref_id)
-        if ref_idea:
-            referenced.append(ref_idea)
-
-    referencing = find_referencing_ideas(event_id)
+    referenced, referencing = await asyncio.gather(
+        loader.get_many(idea.get("references", [])),
+        find_referencing_ideas(event_id)
+    )
 
     return {
         "referenced": referenced,
@@ -221,32 +439,38 @@ async def get_idea_references(event_id: str):
 
 
 @app.get("/api/network-data")
-async def get_network_data():
-    points = get_all_vectors_with_payload(limit=500)
+async def get_network_data(request: Request):
+    return await cached_json_response(request, "network-data", compute_network_data)
+
 
+async def compute_network_data() -> dict:
     nodes = []
     links = []
 
-    for point in points:
-        nodes.append({
-            "id": point.id,
-            "content_preview": point.payload.get("content_preview", ""),
-            "pubkey": point.payload.get("pubkey", "")
-        })
-
-        for ref in point.payload.get("references", []):
-            links.append({
-                "source": point.id,
-                "target": ref
+    pages = iter_point_pages(
+        limit=500, fields=["content_preview", "pubkey", "references"], with_vectors=False
+    )
+    async for points in pages:
+        for point in points:
+            nodes.append({
+                "id": point.id,
+                "content_preview": point.payload.get("content_preview", ""),
+                "pubkey": point.payload.get("pubkey", "")
             })
 
+            for ref in point.payload.get("references", []):
+                links.append({
+                    "source": point.id,
+                    "target": ref
+                })
+
     return {"nodes": nodes, "links": links}
 
 
 @app.get("/stream")
 async def stream(request: Request):
-    queue = asyncio.Queue()
-    event_queues.append(queue)
+    queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+    event_queues.add(queue)
 
     async def event_generator():
         try:
@@ -254,18 +478,16 @@ async def stream(request: Request):
                 if await request.is_disconnected():
                     break
 
-                try:
-                    event = await asyncio.wait_for(queue.get(), timeout=30)
-                    yield {
-                        "event": "new-idea",
-                        "data": json.dumps(event)
-                    }
-                except asyncio.TimeoutError:
-                    yield {"event": "ping", "data": ""}
+                payload = await queue.get()
+                yield {
+                    "event": "new-idea",
+                    "data": payload
+                }
         finally:
-            event_queues.remove(queue)
+            event_queues.discard(queue)
 
-    return EventSourceResponse(event_generator())
+    # sse-starlette sends the keepalive pings from its own task
+    return EventSourceResponse(event_generator(), ping=SSE_PING_INTERVAL)
 
 
 @app.get("/partials/search-results", response_class=HTMLResponse)
@@ -273,158 +495,78 @@ async def search_results_partial(q: str, time: str = None):
     if not q.strip():
         return "<div class='text-gray-500'>Suchbegriff eingeben...</div>"
 
-    results = search_similar(q, limit=10, time_range=time)
-
-    html_parts = []
-    for r in results:
-        score_percent = int(r["score"] * 100)
-        html_parts.append(f'''
-        <article class="idea-card"
-                 hx-get="/components/idea-card/{r['event_id']}"
-                 hx-trigger="click"
-                 hx-target="#idea-detail"
-                 hx-swap="innerHTML">
-            <p class="content">{r['content_preview']}</p>
-            <div class="meta">
-                <span class="score">{score_percent}% Relevanz</span>
-                <span class="pubkey">{r['pubkey'][:8]}...</span>
-            </div>
-        </article>
-        ''')
-
-    if not html_parts:
+    results = await cached_search(q, limit=10, time_range=time, fields=CARD_FIELDS)
+
+    if not results:
         return "<div class='text-gray-500'>Keine Ergebnisse gefunden</div>"
 
-    return "\n".join(html_parts)
+    return "".join(
+        IDEA_CARD_FMT.format(
+            escape(r["event_id"]),
+            escape(r["content_preview"]),
+            SCORE_FMT.format(int(r["score"] * 100)),
+            escape(r["pubkey"][:8])
+        )
+        for r in results
+    )
 
 
 @app.get("/partials/recent-ideas", response_class=HTMLResponse)
 async def recent_ideas_partial(time: str = None):
-    points = get_all_vectors_with_payload(limit=20, time_range=time)
+    ideas = await get_recent_ideas(limit=10, time_range=time)
 
-    sorted_points = sorted(
-        points,
-        key=lambda p: p.payload.get("created_at", 0),
-        reverse=True
-    )
-
-    html_parts = []
-    for point in sorted_points[:10]:
-        event_id = point.payload.get("nostr_event_id", str(point.id))
-        html_parts.append(f'''
-        <article class="idea-card"
-                 hx-get="/components/idea-card/{event_id}"
-                 hx-trigger="click"
-                 hx-target="#idea-detail"
-                 hx-swap="innerHTML">
-            <p class="content">{point.payload.get("content_preview", "")}</p>
-            <div class="meta">
-                <span class="pubkey">{point.payload.get("pubkey", "")[:8]}...</span>
-            </div>
-        </article>
-        ''')
-
-    if not html_parts:
+    if not ideas:
         return "<div class='text-gray-500'>Noch keine Ideen vorhanden</div>"
 
-    return "\n".join(html_parts)
+    return "".join(
+        IDEA_CARD_FMT.format(
+            escape(idea["event_id"]),
+            escape(idea.get("content_preview", "")),
+            "",
+            escape(idea.get("pubkey", "")[:8])
+        )
+        for idea in ideas
+    )
 
 
 def render_idea_card(event: dict, related: list) -> str:
-    related_html = ""
-    if related:
-        related_items = [
-            f'<li><a href="#" hx-get="/components/idea-card/{r["event_id"]}" '
-            f'hx-target="#idea-detail">{r["content_preview"][:50]}...</a></li>'
-            for r in related
-        ]
-        related_html = f'''
-        <div class="related">
-            <h4>Ähnliche Ideen</h4>
-            <ul>{"".join(related_items)}</ul>
-        </div>
-        '''
-
-    from datetime import datetime
     created = datetime.fromtimestamp(event["created_at"]).strftime("%d.%m.%Y %H:%M")
 
-    return f'''
-    <article class="idea-detail">
-        <p class="content">{event["content"]}</p>
-        <div class="meta">
-            <time>{created}</time>
-            <span class="pubkey">{event["pubkey"][:16]}...</span>
-        </div>
-        {related_html}
-    </article>
-    '''
+    return IDEA_DETAIL_TMPL.render(
+        content=event["content"],
+        created=created,
+        pubkey=event["pubkey"],
+        referenced=[],
+        referencing=[],
+        related=related
+    )
 
 
-def render_idea_card_from_payload(payload: dict) -> str:
+async def render_idea_card_from_payload(payload: dict, loader: Optional[IdeaLoader] = None) -> str:
     created = datetime.fromtimestamp(payload.get("created_at", 0)).strftime("%d.%m.%Y %H:%M")
     event_id = payload.get("event_id") or payload.get("nostr_event_id", "")
 
-    # Get referenced ideas (what this idea links to)
-    referenced_ids = payload.get("references", [])
-    referenced_html = ""
-    if referenced_ids:
-        referenced_items = []
-        for ref_id in referenced_ids[:5]:
-            ref_idea = get_idea_by_event_id(ref_id)
-            if ref_idea:
-                referenced_items.append(
-                    f'<li><a href="#" hx-get="/components/idea-card/{ref_id}" '
-                    f'hx-target="#idea-detail">{ref_idea.get("content_preview", "")[:50]}...</a></li>'
-                )
-        if referenced_items:
-            referenced_html = f'''
-            <div class="references">
-                <h4>Verweist auf</h4>
-                <ul>{"".join(referenced_items)}</ul>
-            </div>
-            '''
-
-    # Get referencing ideas (what links to this idea)
-    referencing = find_referencing_ideas(event_id) if event_id else []
-    referencing_html = ""
-    if referencing:
-        referencing_items = [
-            f'<li><a href="#" hx-get="/components/idea-card/{r["event_id"]}" '
-            f'hx-target="#idea-detail">{r.get("content_preview", "")[:50]}...</a></li>'
-            for r in referencing[:5]
-        ]
-        referencing_html = f'''
-        <div class="references">
-            <h4>Verwiesen von</h4>
-            <ul>{"".join(referencing_items)}</ul>
-        </div>
-        '''
-
-    # Similar ideas
-    related = find_related(event_id, limit=3) if event_id else []
-    related_html = ""
-    if related:
-        related_items = [
-            f'<li><a href="#" hx-get="/components/idea-card/{r["event_id"]}" '
-            f'hx-target="#idea-detail">{r["content_preview"][:50]}...</a></li>'
-            for r in related
-        ]
-        related_html = f'''
-        <div class="related">
-            <h4>Ähnliche Ideen</h4>
-            <ul>{"".join(related_items)}</ul>
-        </div>
-        '''
-
-    return f'''
-    <article class="idea-detail">
-        <p class="content">{payload.get("content_preview", "")}</p>
-        <div class="meta">
-            <time>{created}</time>
-            <span class="pubkey">{payload.get("pubkey", "")[:16]}...</span>
-        </div>
-        {referenced_html}
-        {referencing_html}
-        {related_html}
-    </article>
-    '''
+    # Referenced ideas (what this idea links to), fetched in a single request
+    # unless the request's loader already has them
+    referenced_ids = payload.get("references", [])[:5]
+    loader = loader or IdeaLoader()
+
+    if event_id:
+        # Referencing ideas (what links to this idea) and similar ideas alongside
+        referenced, referencing, related = await asyncio.gather(
+            loader.get_many(referenced_ids),
+            find_referencing_ideas(event_id, limit=5, fields=LINK_FIELDS),
+            find_related(event_id, limit=3, fields=LINK_FIELDS)
+        )
+    else:
+        referenced = await loader.get_many(referenced_ids)
+        referencing, related = [], []
+
+    return IDEA_DETAIL_TMPL.render(
+        content=payload.get("content_preview", ""),
+        created=created,
+        pubkey=payload.get("pubkey", ""),
+        referenced=referenced,
+        referencing=referencing,
+        related=related
+    )
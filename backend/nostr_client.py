@@ -1,11 +1,19 @@
 import asyncio
-import json
+import itertools
+import orjson
 import websockets
 from typing import Callable, Optional
 import os
 
 RELAY_URL = os.getenv("NOSTR_RELAY_URL", "ws://localhost:8080")
 
+# Subscription callbacks allowed to run at once; the receiver waits beyond that
+MAX_CALLBACKS = 16
+
+# Bound once to skip the attribute lookup per message
+_dumps = orjson.dumps
+_loads = orjson.loads
+
 
 class NostrClient:
     """
@@ -15,11 +23,16 @@ class NostrClient:
 
     def __init__(self, relay_url: str = RELAY_URL):
         self.relay_url = relay_url
-        self.ws: Optional[websockets.WebSocketClientProtocol] = None
+        self.ws: Optional[websockets.ClientConnection] = None
         self.subscriptions: dict[str, Callable] = {}
         self._connect_lock = asyncio.Lock()
         self._send_lock = asyncio.Lock()
         self._pending_publishes: dict[str, asyncio.Future] = {}
+        # One-shot fetches: events are queued per sub_id, None marks EOSE
+        self._fetch_queues: dict[str, asyncio.Queue] = {}
+        self._callback_tasks: set[asyncio.Task] = set()
+        self._callback_slots = asyncio.Semaphore(MAX_CALLBACKS)
+        self._fetch_counter = itertools.count()
         self._receiver_task: Optional[asyncio.Task] = None
         self._running = False
 
@@ -34,7 +47,11 @@ class NostrClient:
     async def connect(self):
         async with self._connect_lock:
             if not self._is_connected():
-                self.ws = await websockets.connect(self.relay_url)
+                # Small, high-entropy JSON frames: deflate costs more CPU than
+                # it saves in bandwidth. Long-form ideas may exceed the 1 MiB default.
+                self.ws = await websockets.connect(
+                    self.relay_url, compression=None, max_size=2**22
+                )
                 self._running = True
                 # Start receiver loop if not already running
                 if self._receiver_task is None or self._receiver_task.done():
@@ -48,6 +65,9 @@ class NostrClient:
                 await self._receiver_task
             except asyncio.CancelledError:
                 pass
+        for task in self._callback_tasks:
+            task.cancel()
+        await asyncio.gather(*self._callback_tasks, return_exceptions=True)
         if self.ws:
             await self.ws.close()
 
@@ -59,31 +79,40 @@ class NostrClient:
                     await asyncio.sleep(1)
                     continue
 
-                message = await self.ws.recv()
-                data = json.loads(message)
+                # Raw bytes: orjson validates UTF-8 while parsing anyway
+                message = await self.ws.recv(decode=False)
+                data = _loads(message)
 
                 msg_type = data[0]
 
                 if msg_type == "EVENT":
-                    # Subscription event
                     sub_id = data[1]
                     event = data[2]
-                    if sub_id in self.subscriptions:
-                        try:
-                            await self.subscriptions[sub_id](event)
-                        except Exception as e:
-                            print(f"Subscription callback error: {e}")
+                    if sub_id in self._fetch_queues:
+                        self._fetch_queues[sub_id].put_nowait(event)
+                    elif sub_id in self.subscriptions:
+                        # Run the callback as its own task so a slow handler
+                        # doesn't hold up OK responses behind it
+                        await self._callback_slots.acquire()
+                        task = asyncio.create_task(
+                            self._run_callback(self.subscriptions[sub_id], event)
+                        )
+                        self._callback_tasks.add(task)
+                        task.add_done_callback(self._callback_done)
 
                 elif msg_type == "OK":
                     # Publish response
                     event_id = data[1]
                     success = data[2]
-                    if event_id in self._pending_publishes:
-                        self._pending_publishes[event_id].set_result(success)
+                    future = self._pending_publishes.get(event_id)
+                    if future and not future.done():
+                        future.set_result(success)
 
                 elif msg_type == "EOSE":
-                    # End of stored events - handled by fetch_events
-                    pass
+                    # End of stored events
+                    sub_id = data[1]
+                    if sub_id in self._fetch_queues:
+                        self._fetch_queues[sub_id].put_nowait(None)
 
                 elif msg_type == "NOTICE":
                     print(f"Relay notice: {data[1]}")
@@ -103,37 +132,61 @@ class NostrClient:
                 print(f"Receiver error: {e}")
                 await asyncio.sleep(0.1)
 
+    def _callback_done(self, task: asyncio.Task):
+        # Also runs for tasks cancelled before they started, unlike a finally
+        self._callback_tasks.discard(task)
+        self._callback_slots.release()
+
+    async def _run_callback(self, callback: Callable, event: dict):
+        try:
+            await callback(event)
+        except Exception as e:
+            print(f"Subscription callback error: {e}")
+
     async def publish_event(self, event: dict, timeout: float = 5.0) -> bool:
         """Publish an event and wait for OK response."""
-        await self.connect()
+        results = await self.publish_events([event], timeout=timeout)
+        return results[0]
 
-        event_id = event.get("id")
-        if not event_id:
-            return False
+    async def publish_events(self, events: list[dict], timeout: float = 5.0) -> list[bool]:
+        """Publish events back-to-back, then wait for all OK responses at once."""
+        await self.connect()
 
-        # Create future for response
-        future = asyncio.get_event_loop().create_future()
-        self._pending_publishes[event_id] = future
+        # Create futures for responses; events without an id can't be acknowledged
+        loop = asyncio.get_running_loop()
+        futures = {
+            event["id"]: loop.create_future()
+            for event in events if event.get("id")
+        }
+        if not futures:
+            return [False] * len(events)
+        self._pending_publishes.update(futures)
 
         try:
+            frames = [_dumps(["EVENT", event]) for event in events if event.get("id")]
             async with self._send_lock:
-                message = json.dumps(["EVENT", event])
-                await self.ws.send(message)
+                for frame in frames:
+                    # orjson already produces UTF-8, send it as a text frame as-is
+                    await self.ws.send(frame, text=True)
 
-            # Wait for OK response
-            success = await asyncio.wait_for(future, timeout=timeout)
-            return success
+            # Wait for OK responses
+            _, pending = await asyncio.wait(futures.values(), timeout=timeout)
+            if pending:
+                print(f"Publish timeout for {len(pending)} of {len(futures)} events")
 
-        except asyncio.TimeoutError:
-            print(f"Publish timeout for event {event_id[:8]}...")
-            return False
+            results = []
+            for event in events:
+                future = futures.get(event.get("id"))
+                results.append(future is not None and future.done() and bool(future.result()))
+            return results
 
         except Exception as e:
             print(f"Publish error: {e}")
-            return False
+            return [False] * len(events)
 
         finally:
-            self._pending_publishes.pop(event_id, None)
+            for event_id in futures:
+                self._pending_publishes.pop(event_id, None)
 
     async def subscribe(self, sub_id: str, filters: list[dict], callback: Callable):
         """Subscribe to events matching filters."""
@@ -142,8 +195,7 @@ class NostrClient:
         self.subscriptions[sub_id] = callback
 
         async with self._send_lock:
-            message = json.dumps(["REQ", sub_id, *filters])
-            await self.ws.send(message)
+            await self.ws.send(_dumps(["REQ", sub_id, *filters]), text=True)
 
     async def unsubscribe(self, sub_id: str):
         """Close a subscription."""
@@ -152,4 +204,63 @@ class NostrClient:
 
         if self._is_connected():
             async with self._send_lock:
-                await self.ws.send(json.dumps(["CLOSE", sub_id]))
+                await self.ws.send(_dumps(["CLOSE", sub_id]), text=True)
+
+    async def fetch_events(self, filters: list[dict], timeout: float = 5.0) -> list[dict]:
+        """Fetch stored events matching filters, up to the relay's EOSE."""
+        await self.connect()
+
+        # A counter, unlike id(filters), is never reused while a fetch is open
+        sub_id = f"fetch-{next(self._fetch_counter)}"
+        close_frame = _dumps(["CLOSE", sub_id])
+        queue = asyncio.Queue()
+        self._fetch_queues[sub_id] = queue
+
+        events = []
+        try:
+            async with self._send_lock:
+                await self.ws.send(_dumps(["REQ", sub_id, *filters]), text=True)
+
+            async with asyncio.timeout(timeout):
+                while (event := await queue.get()) is not None:
+                    events.append(event)
+
+        except TimeoutError:
+            print(f"Fetch timeout for {sub_id}, returning {len(events)} events")
+
+        finally:
+            self._fetch_queues.pop(sub_id, None)
+            if self._is_connected():
+                async with self._send_lock:
+                    await self.ws.send(close_frame, text=True)
+
+        return events
+
+
+async def fetch_events_from_relays(relay_urls: list[str], filters: list[dict],
+                                   timeout: float = 5.0) -> list[dict]:
+    """Fetch matching events from several relays concurrently, deduplicated by event ID."""
+    async def fetch_one(relay_url: str) -> list[dict]:
+        client = NostrClient(relay_url)
+        try:
+            return await client.fetch_events(filters, timeout=timeout)
+        finally:
+            await client.close()
+
+    results = await asyncio.gather(
+        *(fetch_one(relay_url) for relay_url in relay_urls),
+        return_exceptions=True
+    )
+
+    seen = set()
+    events = []
+    for relay_url, result in zip(relay_urls, results):
+        if isinstance(result, Exception):
+            print(f"Fetch from {relay_url} failed: {result}")
+            continue
+        for event in result:
+            if event["id"] not in seen:
+                seen.add(event["id"])
+                events.append(event)
+
+    return events
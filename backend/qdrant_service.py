@@ -1,31 +1,39 @@
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.exceptions import UnexpectedResponse
 from qdrant_client.models import (
     Distance, VectorParams, PointStruct,
-    Filter, FieldCondition, MatchValue, Range
+    Filter, FieldCondition, MatchValue, Range,
+    OrderBy, Direction,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    KeywordIndexParams, KeywordIndexType,
+    IntegerIndexParams, IntegerIndexType
 )
+import asyncio
+import grpc
 import os
 import uuid
 import time
-from typing import Optional
-from embedding_service import create_embedding
+from functools import lru_cache
+from typing import AsyncIterator, Optional
+from embedding_service import create_embeddings_batch
+
+
+TIME_RANGES = {
+    '24h': 24 * 60 * 60,
+    '7d': 7 * 24 * 60 * 60,
+    '30d': 30 * 24 * 60 * 60
+}
+# Filters round thresholds down to this step so they can be cached and shared
+FILTER_THRESHOLD_STEP = 60  # seconds
 
 
 def get_time_threshold(time_range: Optional[str]) -> Optional[int]:
     """Convert time range string to Unix timestamp threshold."""
-    if not time_range or time_range == 'all':
+    seconds = TIME_RANGES.get(time_range)
+    if not seconds:
         return None
 
-    now = int(time.time())
-    ranges = {
-        '24h': 24 * 60 * 60,
-        '7d': 7 * 24 * 60 * 60,
-        '30d': 30 * 24 * 60 * 60
-    }
-
-    seconds = ranges.get(time_range)
-    if seconds:
-        return now - seconds
-    return None
+    return int(time.time()) - seconds
 
 
 def event_id_to_uuid(event_id: str) -> str:
@@ -37,74 +45,161 @@ def event_id_to_uuid(event_id: str) -> str:
 COLLECTION_NAME = "ideas"
 VECTOR_SIZE = 384  # all-MiniLM-L6-v2
 
-client: Optional[QdrantClient] = None
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", 8))
+QDRANT_TIMEOUT = 30  # seconds
+SCROLL_PAGE_SIZE = 256
+
+# int8 copies of the vectors kept in RAM for search; originals rescore the top hits
+QUANTIZATION_CONFIG = ScalarQuantization(
+    scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+)
 
+# Payload projections for callers that only render part of an idea
+CARD_FIELDS = ["nostr_event_id", "pubkey", "content_preview"]
+LINK_FIELDS = ["nostr_event_id", "content_preview"]
 
-def get_client() -> QdrantClient:
+PAYLOAD_INDEXES = {
+    # Ideas are mostly filtered per author: co-locate each pubkey's vectors
+    "pubkey": KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True),
+    # Only range filters and order_by, no exact-match lookups
+    "created_at": IntegerIndexParams(type=IntegerIndexType.INTEGER, lookup=False, range=True),
+    "references": KeywordIndexParams(type=KeywordIndexType.KEYWORD),
+}
+
+client: Optional[AsyncQdrantClient] = None
+
+
+def get_client() -> AsyncQdrantClient:
     global client
     if client is None:
-        client = QdrantClient(
+        # gRPC skips the REST/JSON layer; the HTTP port stays for fallback calls.
+        # pool_size keeps that many persistent gRPC channels / HTTP keep-alive
+        # connections for concurrent requests
+        client = AsyncQdrantClient(
             host=os.getenv("QDRANT_HOST", "localhost"),
-            port=int(os.getenv("QDRANT_PORT", 6333))
+            port=int(os.getenv("QDRANT_PORT", 6333)),
+            grpc_port=int(os.getenv("QDRANT_GRPC_PORT", 6334)),
+            prefer_grpc=os.getenv("QDRANT_PREFER_GRPC", "1") == "1",
+            pool_size=QDRANT_POOL_SIZE,
+            timeout=QDRANT_TIMEOUT
         )
     return client
 
 
-def init_collection():
+async def close_client():
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
+
+async def init_collection():
     client = get_client()
-    collections = client.get_collections().collections
+    collections = (await client.get_collections()).collections
     exists = any(c.name == COLLECTION_NAME for c in collections)
 
     if not exists:
-        client.create_collection(
+        await client.create_collection(
             collection_name=COLLECTION_NAME,
             vectors_config=VectorParams(
                 size=VECTOR_SIZE,
                 distance=Distance.COSINE
-            )
-        )
-        client.create_payload_index(
-            collection_name=COLLECTION_NAME,
-            field_name="pubkey",
-            field_schema="keyword"
+            ),
+            quantization_config=QUANTIZATION_CONFIG
         )
-        client.create_payload_index(
+
+    # Also brings collections created by older versions up to date
+    info = await client.get_collection(COLLECTION_NAME)
+    if info.config.quantization_config is None:
+        await client.update_collection(
             collection_name=COLLECTION_NAME,
-            field_name="created_at",
-            field_schema="integer"
+            quantization_config=QUANTIZATION_CONFIG
         )
+    for field_name, params in PAYLOAD_INDEXES.items():
+        existing = info.payload_schema.get(field_name)
+        if existing is None or not _index_params_match(existing.params, params):
+            await client.create_payload_index(
+                collection_name=COLLECTION_NAME,
+                field_name=field_name,
+                field_schema=params
+            )
+
 
+def _index_params_match(existing, wanted) -> bool:
+    # Compare only what we set; the server fills in its own defaults for the rest
+    if existing is None:
+        return False
+    return all(
+        getattr(existing, key, None) == value
+        for key, value in wanted.model_dump(exclude_none=True).items()
+    )
+
+
+async def store_idea(event_id: str, content: str, pubkey: str,
+                     created_at: int, references: list[str]):
+    await store_ideas([{
+        "event_id": event_id,
+        "content": content,
+        "pubkey": pubkey,
+        "created_at": created_at,
+        "references": references
+    }])
+
+
+async def store_ideas(ideas: list[dict]):
+    """Embed several ideas in one batch and upsert them in a single request."""
+    if not ideas:
+        return
 
-def store_idea(event_id: str, content: str, pubkey: str,
-               created_at: int, references: list[str]):
     client = get_client()
-    vector = create_embedding(content)
-    point_id = event_id_to_uuid(event_id)
+    vectors = await asyncio.to_thread(
+        create_embeddings_batch, [idea["content"] for idea in ideas]
+    )
 
-    client.upsert(
+    await client.upsert(
         collection_name=COLLECTION_NAME,
         points=[
             PointStruct(
-                id=point_id,
+                id=event_id_to_uuid(idea["event_id"]),
                 vector=vector,
                 payload={
-                    "nostr_event_id": event_id,
-                    "pubkey": pubkey,
-                    "created_at": created_at,
-                    "references": references,
-                    "content_preview": content[:200]
+                    "nostr_event_id": idea["event_id"],
+                    "pubkey": idea["pubkey"],
+                    "created_at": idea["created_at"],
+                    "references": idea["references"],
+                    "content_preview": idea["content"][:200]
                 }
             )
+            for idea, vector in zip(ideas, vectors)
         ]
     )
 
 
-def search_similar(query: str, limit: int = 10,
-                   pubkey_filter: Optional[str] = None,
-                   time_range: Optional[str] = None) -> list[dict]:
+async def update_idea_payload(event_id: str, payload: dict):
+    """Change payload fields of a stored idea without re-embedding or re-sending its vector."""
     client = get_client()
-    query_vector = create_embedding(query)
 
+    await client.set_payload(
+        collection_name=COLLECTION_NAME,
+        payload=payload,
+        points=[event_id_to_uuid(event_id)]
+    )
+
+
+def build_filter(pubkey_filter: Optional[str] = None,
+                 time_range: Optional[str] = None) -> Optional[Filter]:
+    """Build the payload filter shared by search and listing queries."""
+    time_threshold = get_time_threshold(time_range)
+    if time_threshold:
+        # Whole minutes, so requests within the same minute share one cached Filter
+        time_threshold -= time_threshold % FILTER_THRESHOLD_STEP
+    return _cached_filter(pubkey_filter, time_threshold)
+
+
+@lru_cache(maxsize=1024)
+def _cached_filter(pubkey_filter: Optional[str],
+                   time_threshold: Optional[int]) -> Optional[Filter]:
+    # Shared between requests, so callers must treat the result as read-only
     filter_conditions = []
 
     if pubkey_filter:
@@ -115,7 +210,6 @@ def search_similar(query: str, limit: int = 10,
             )
         )
 
-    time_threshold = get_time_threshold(time_range)
     if time_threshold:
         filter_conditions.append(
             FieldCondition(
@@ -124,121 +218,144 @@ def search_similar(query: str, limit: int = 10,
             )
         )
 
-    search_filter = Filter(must=filter_conditions) if filter_conditions else None
+    return Filter(must=filter_conditions) if filter_conditions else None
 
-    results = client.query_points(
-        collection_name=COLLECTION_NAME,
-        query=query_vector,
-        limit=limit,
-        query_filter=search_filter,
-        with_payload=True
-    )
 
-    return [
-        {
-            "event_id": hit.payload.get("nostr_event_id", str(hit.id)),
-            "score": hit.score,
-            **hit.payload
-        }
-        for hit in results.points
-    ]
+def _idea_from_point(point, score: Optional[float] = None) -> dict:
+    """Turn a point's payload into an idea dict in place instead of copying it."""
+    idea = point.payload
+    idea["event_id"] = idea.get("nostr_event_id", str(point.id))
+    if score is not None:
+        idea["score"] = score
+    return idea
 
 
-def find_related(event_id: str, limit: int = 5) -> list[dict]:
+async def search_similar(query_vector: list[float], limit: int = 10,
+                         pubkey_filter: Optional[str] = None,
+                         time_range: Optional[str] = None,
+                         fields: Optional[list[str]] = None) -> list[dict]:
     client = get_client()
-    point_id = event_id_to_uuid(event_id)
 
-    points = client.retrieve(
-        collection_name=COLLECTION_NAME,
-        ids=[point_id],
-        with_vectors=True
-    )
+    search_filter = build_filter(pubkey_filter, time_range)
 
-    if not points:
-        return []
-
-    vector = points[0].vector
-
-    results = client.query_points(
+    results = await client.query_points(
         collection_name=COLLECTION_NAME,
-        query=vector,
-        limit=limit + 1,
-        with_payload=True
+        query=query_vector,
+        limit=limit,
+        query_filter=search_filter,
+        with_payload=fields or True
     )
 
-    return [
-        {
-            "event_id": hit.payload.get("nostr_event_id", str(hit.id)),
-            "score": hit.score,
-            **hit.payload
-        }
-        for hit in results.points
-        if hit.id != point_id
-    ][:limit]
+    return [_idea_from_point(hit, hit.score) for hit in results.points]
 
 
-def get_idea_by_event_id(event_id: str) -> Optional[dict]:
-    """Get a single idea by its Nostr event ID."""
+async def find_related(event_id: str, limit: int = 5,
+                       fields: Optional[list[str]] = None) -> list[dict]:
     client = get_client()
     point_id = event_id_to_uuid(event_id)
 
-    points = client.retrieve(
+    # Querying by ID lets Qdrant look up the stored vector itself, in one request
+    try:
+        results = await client.query_points(
+            collection_name=COLLECTION_NAME,
+            query=point_id,
+            limit=limit,
+            with_payload=fields or True
+        )
+    except UnexpectedResponse as e:
+        if e.status_code == 404:
+            # Unknown point ID
+            return []
+        raise
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.NOT_FOUND:
+            return []
+        raise
+
+    return [_idea_from_point(hit, hit.score) for hit in results.points]
+
+
+async def get_ideas_by_event_ids(event_ids: list[str]) -> list[dict]:
+    """Get several ideas by their Nostr event IDs in one request, in input order."""
+    if not event_ids:
+        return []
+
+    client = get_client()
+    points = await client.retrieve(
         collection_name=COLLECTION_NAME,
-        ids=[point_id],
+        ids=[event_id_to_uuid(event_id) for event_id in event_ids],
         with_payload=True
     )
 
-    if not points:
-        return None
+    by_event_id = {}
+    for point in points:
+        idea = _idea_from_point(point)
+        by_event_id[idea["event_id"]] = idea
 
-    return {
-        "event_id": points[0].payload.get("nostr_event_id", str(points[0].id)),
-        **points[0].payload
-    }
+    return [by_event_id[event_id] for event_id in event_ids if event_id in by_event_id]
 
 
-def get_all_vectors_with_payload(limit: int = 1000, time_range: Optional[str] = None) -> list:
+async def get_recent_ideas(limit: int = 10, time_range: Optional[str] = None,
+                           pubkey: Optional[str] = None) -> list[dict]:
+    """Get the newest ideas, filtered and ordered by Qdrant's payload indexes."""
     client = get_client()
 
-    scroll_filter = None
-    time_threshold = get_time_threshold(time_range)
-    if time_threshold:
-        scroll_filter = Filter(
-            must=[
-                FieldCondition(
-                    key="created_at",
-                    range=Range(gte=time_threshold)
-                )
-            ]
-        )
-
-    points, _ = client.scroll(
+    points, _ = await client.scroll(
         collection_name=COLLECTION_NAME,
+        scroll_filter=build_filter(pubkey, time_range),
         limit=limit,
-        scroll_filter=scroll_filter,
-        with_vectors=True,
-        with_payload=True
+        order_by=OrderBy(key="created_at", direction=Direction.DESC),
+        with_payload=True,
+        with_vectors=False
     )
-    return points
 
+    return [_idea_from_point(point) for point in points]
+
+
+async def iter_point_pages(limit: int = 1000, time_range: Optional[str] = None,
+                           fields: Optional[list[str]] = None, with_vectors: bool = True,
+                           page_size: int = SCROLL_PAGE_SIZE) -> AsyncIterator[list]:
+    """Yield up to limit points page by page, fetching the next page while the caller works."""
+    client = get_client()
+    scroll_filter = build_filter(time_range=time_range)
 
-def find_referencing_ideas(event_id: str) -> list[dict]:
+    def fetch_page(offset, remaining: int) -> asyncio.Future:
+        return asyncio.ensure_future(client.scroll(
+            collection_name=COLLECTION_NAME,
+            limit=min(page_size, remaining),
+            offset=offset,
+            scroll_filter=scroll_filter,
+            with_vectors=with_vectors,
+            with_payload=fields or True
+        ))
+
+    remaining = limit
+    pending = fetch_page(None, remaining)
+    try:
+        while pending is not None:
+            points, offset = await pending
+            remaining -= len(points)
+            pending = fetch_page(offset, remaining) if offset is not None and remaining > 0 else None
+            yield points
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def find_referencing_ideas(event_id: str, limit: int = 1000,
+                                 fields: Optional[list[str]] = None) -> list[dict]:
     """Find ideas that reference the given event_id."""
     client = get_client()
 
-    points, _ = client.scroll(
+    # Served by the keyword index on "references"; matches any list element
+    points, _ = await client.scroll(
         collection_name=COLLECTION_NAME,
-        limit=100,
-        with_payload=True
+        scroll_filter=Filter(must=[
+            FieldCondition(key="references", match=MatchValue(value=event_id))
+        ]),
+        limit=limit,
+        with_payload=fields or True,
+        with_vectors=False
     )
 
-    referencing = []
-    for point in points:
-        refs = point.payload.get("references", [])
-        if event_id in refs:
-            referencing.append({
-                "event_id": point.payload.get("nostr_event_id", str(point.id)),
-                **point.payload
-            })
-
-    return referencing
+    return [_idea_from_point(point) for point in points]